@@ -1,112 +1,222 @@
+import argparse
+import functools
+import os
 import re
-import PyPDF2
+import string
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import pymupdf as fitz
 from lxml import etree
 
-def extract_xfa_data(pdf_path):
+# Matches indirect references ("12 0 R") inside a serialized PDF object.
+_INDIRECT_REF_RE = re.compile(r'(\d+)\s+\d+\s+R')
+# Matches the encoding pseudo-attribute of an XML declaration.
+_ENCODING_RE = re.compile(rb'encoding\s*=\s*["\']([A-Za-z][A-Za-z0-9._-]*)["\']')
+
+# Parser settings shared by every XML parse: allow payloads beyond libxml2's
+# default size limits, never expand entities or touch the network, and skip
+# the xml:id table that XFA does not use.
+_XML_PARSER_OPTIONS = dict(huge_tree=True, resolve_entities=False, no_network=True, collect_ids=False)
+# Reused for one-shot parses. Not thread-safe; each worker process has its own.
+_XML_PARSER = etree.XMLParser(**_XML_PARSER_OPTIONS)
+
+# Number of leading pages checked for a non-standard /Resources/XFA entry.
+_XFA_PAGE_SCAN_LIMIT = 2
+
+# Synthetic root used when the packets do not carry their own <xdp:xdp> wrapper.
+_XDP_OPEN = b'<xdp:xdp xmlns:xdp="http://ns.adobe.com/xdp/">'
+_XDP_CLOSE = b'</xdp:xdp>'
+
+# XPath lookups are compiled once at import instead of on every call.
+XFA_NS = {"xfa": "http://www.xfa.org/schema/xfa-template/3.3/"}
+_XP_SCRIPTS = etree.XPath(".//xfa:script", namespaces=XFA_NS)
+_TEMPLATE_TAG = "{%s}template" % XFA_NS["xfa"]
+_XP_ITEMS = etree.XPath("./item")
+_XP_EXCLCHOICE = etree.XPath("./exclchoice")
+
+def extract_xfa_packets(pdf_path):
+    """
+    Returns the raw XFA packet streams (bytes) in document order, or None
+    if the PDF carries no XFA data.
+    """
     try:
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            xfa_data = None
-
-            # 1. Check for XFA data directly on the reader.
-            if hasattr(reader, 'xfa') and reader.xfa:
-                xfa_data = reader.xfa
-
-            # 2. Check the AcroForm dictionary.
-            elif "/AcroForm" in reader.trailer["/Root"]:
-                acroform = reader.trailer["/Root"].get("/AcroForm", {})
-                if "/XFA" in acroform:
-                    xfa_data = acroform["/XFA"]
-
-            # 3. Fallback: iterate through each page's resources.
-            if not xfa_data:
-                for page in reader.pages:
-                    resources = page.get("/Resources")
-                    if resources and "/XFA" in resources:
-                        xfa_data = resources["/XFA"]
+        with fitz.open(pdf_path) as doc:
+            xfa_type, xfa_value = "null", "null"
+            catalog_xref = doc.pdf_catalog()
+
+            # 1. Check the AcroForm dictionary (inline or indirect).
+            acroform_type, acroform_value = doc.xref_get_key(catalog_xref, "AcroForm")
+            if acroform_type == "xref":
+                acroform_xref = int(acroform_value.split()[0])
+                xfa_type, xfa_value = doc.xref_get_key(acroform_xref, "XFA")
+            elif acroform_type == "dict":
+                xfa_type, xfa_value = doc.xref_get_key(catalog_xref, "AcroForm/XFA")
+
+            # 2. Fallback: check the first pages' resources. Only done when there
+            # is no AcroForm at all, since XFA lives there per spec and walking
+            # every page of a long document is wasted work.
+            if xfa_type == "null" and acroform_type == "null":
+                for page_no in range(min(doc.page_count, _XFA_PAGE_SCAN_LIMIT)):
+                    xfa_type, xfa_value = doc.xref_get_key(doc.page_xref(page_no), "Resources/XFA")
+                    if xfa_type != "null":
                         break
 
-            if not xfa_data:
+            if xfa_type == "null":
                 print("No XFA data found in the PDF.")
                 return None
 
-            # Now decode the XFA data depending on its type.
-            if isinstance(xfa_data, PyPDF2.generic.IndirectObject):
-                xfa_data = xfa_data.get_object().get_data()
-                if isinstance(xfa_data, bytes):
-                    xfa_data = xfa_data.decode('utf-8', errors='replace')
-            elif isinstance(xfa_data, list):
-                xml_parts = []
-                # Expect alternating keys and values
-                for i in range(0, len(xfa_data), 2):
-                    if i + 1 < len(xfa_data):
-                        part = xfa_data[i+1]
-                        if isinstance(part, PyPDF2.generic.IndirectObject):
-                            part = part.get_object().get_data()
-                        if isinstance(part, bytes):
-                            part = part.decode('utf-8', errors='replace')
-                        xml_parts.append(part)
-                xfa_data = "\n".join(xml_parts)
-            elif isinstance(xfa_data, dict):
-                ordered_keys = ["preamble", "config"]
-                parts = []
-                for key in ordered_keys:
-                    if key in xfa_data:
-                        value = xfa_data[key]
-                        if isinstance(value, bytes):
-                            value = value.decode('utf-8', errors='replace')
-                        parts.append(value)
-                for key, value in xfa_data.items():
-                    if key not in ordered_keys:
-                        if isinstance(value, bytes):
-                            value = value.decode('utf-8', errors='replace')
-                        parts.append(value)
-                xfa_data = "\n".join(parts)
-
-            if not isinstance(xfa_data, str):
-                xfa_data = str(xfa_data)
+            # An indirect /XFA may point at the packet array rather than a stream.
+            if xfa_type == "xref":
+                xfa_xref = int(xfa_value.split()[0])
+                if not doc.xref_is_stream(xfa_xref):
+                    xfa_value = doc.xref_object(xfa_xref, compressed=True)
+                    xfa_type = "array" if xfa_value.lstrip().startswith("[") else "indirect object"
+
+            # Now collect the packet streams depending on the XFA type.
+            if xfa_type == "xref":
+                part = doc.xref_stream(xfa_xref)
+                packets = [part] if part is not None else []
+            elif xfa_type == "array":
+                packets = []
+                # Expect alternating packet names and stream references;
+                # only the references are needed, read once per packet.
+                for xref in _INDIRECT_REF_RE.findall(xfa_value):
+                    part = doc.xref_stream(int(xref))
+                    if part is not None:
+                        packets.append(part)
+            else:
+                # Per spec XFA is a stream or an array of streams; never
+                # serialize an arbitrary object graph as if it were XML.
+                raise ValueError(f"Unsupported XFA container type: {xfa_type}")
 
-            return xfa_data
+            return packets
 
     except Exception as e:
         print("Error during XFA extraction:", e)
         return None
 
-def complete_xml(xfa_str):
-    # Remove leading whitespace
-    xfa_str = xfa_str.lstrip()
+def _join_packets(packets):
+    # Join at the bytes level; decoding to str first would only be undone
+    # when the result is handed back to the parser.
+    buf = bytearray()
+    for part in packets:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        buf += part
+        buf += b"\n"
+    return bytes(buf)
 
-    # Capture the first XML declaration if present
-    first_decl_match = re.match(r'^(<\?xml.*?\?>)', xfa_str, re.DOTALL)
-    first_decl = first_decl_match.group(1) if first_decl_match else ''
+def extract_xfa_data(pdf_path):
+    """
+    Returns all XFA packets joined into a single bytes object, or None.
+    """
+    packets = extract_xfa_packets(pdf_path)
+    if packets is None:
+        return None
+    return _join_packets(packets)
 
-    # Remove any XML declarations found anywhere in the string
-    xfa_str = re.sub(r'<\?xml.*?\?>', '', xfa_str, flags=re.DOTALL)
+def _declared_encoding(packet):
+    # Returns the encoding named in a leading <?xml ...?> declaration, or None.
+    body = packet.lstrip()
+    if not body.startswith(b"<?xml"):
+        return None
+    end = body.find(b"?>")
+    if end == -1:
+        return None
+    match = _ENCODING_RE.search(body, 0, end)
+    return match.group(1).decode("ascii") if match else None
 
-    # Prepend the first declaration (if any)
-    if first_decl:
-        xfa_str = first_decl + xfa_str
+def parse_xfa_packets(packets):
+    """
+    Feeds the XFA packets straight into an incremental lxml parser and
+    returns the root element, without joining them into one string first.
+    The <?xml ...?> prologs of all but the first packet are sliced off. Raises
+    etree.XMLSyntaxError if the packets do not form a well-formed document.
+    """
+    first = packets[0] if packets else b""
+    # Packet arrays normally open <xdp:xdp> in the preamble themselves,
+    # possibly after <?xfa ...?> processing instructions or comments. With no
+    # packets nothing is fed, so close() raises as for any empty document.
+    wrap = bool(packets) and b"<xdp:xdp" not in first
+    # The synthetic root has to precede the first packet's declaration, which
+    # is then dropped, so hand its encoding to the parser instead.
+    encoding = _declared_encoding(first) if wrap else None
+    # A fresh parser per call: feed() state must not leak between documents.
+    parser = etree.XMLParser(encoding=encoding, remove_blank_text=False, **_XML_PARSER_OPTIONS)
+    if wrap:
+        parser.feed(_XDP_OPEN)
+    for i, packet in enumerate(packets):
+        body = packet.lstrip()
+        # Keep the first packet's declaration (and its encoding) when it
+        # starts the document; any later one would be a syntax error.
+        if (i or wrap) and body.startswith(b"<?xml"):
+            end = body.find(b"?>")
+            if end != -1:
+                body = body[end + 2:]
+        parser.feed(body)
+    if wrap:
+        parser.feed(_XDP_CLOSE)
+    return parser.close()
+
+def complete_xml(xfa_data):
+    """
+    Reassembles partial or malformed XFA: keeps the leading XML declaration,
+    drops any others, and trims the data to the <xdp:xdp> (or <config>) root,
+    closing it if needed. The declarations are handled in a single scan that
+    collects the slices to keep, so the data is copied only once.
+    """
+    # Skip leading whitespace
+    pos = 0
+    while pos < len(xfa_data) and xfa_data[pos] in b" \t\r\n\x0b\x0c":
+        pos += 1
+
+    parts = []
+    # Keep the first XML declaration if present
+    if xfa_data.startswith(b"<?xml", pos):
+        decl_end = xfa_data.find(b"?>", pos + 5)
+        if decl_end != -1:
+            parts.append(xfa_data[pos:decl_end + 2])
+            pos = decl_end + 2
+
+    # Drop any further XML declarations found anywhere in the data
+    while True:
+        decl_start = xfa_data.find(b"<?xml", pos)
+        if decl_start == -1:
+            break
+        decl_end = xfa_data.find(b"?>", decl_start + 5)
+        if decl_end == -1:
+            break
+        parts.append(xfa_data[pos:decl_start])
+        pos = decl_end + 2
+    parts.append(xfa_data[pos:])
+    xfa_data = b"".join(parts)
 
     # Try to locate a valid root element.
-    if "<xdp:xdp" in xfa_str:
-        start_index = xfa_str.find("<xdp:xdp")
-        closing_tag = "</xdp:xdp>"
-    elif "<config" in xfa_str:
-        start_index = xfa_str.find("<config")
-        closing_tag = "</config>"
+    start_index = xfa_data.find(b"<xdp:xdp")
+    if start_index != -1:
+        closing_tag = b"</xdp:xdp>"
     else:
-        # If no known root found, return the original string.
-        return xfa_str
+        start_index = xfa_data.find(b"<config")
+        if start_index == -1:
+            # If no known root found, return the cleaned data.
+            return xfa_data
+        closing_tag = b"</config>"
 
     # Find the closing tag after the start_index
-    end_index = xfa_str.find(closing_tag, start_index)
+    end_index = xfa_data.find(closing_tag, start_index)
     if end_index == -1:
         # If closing tag not found, append it.
-        xfa_str = xfa_str[start_index:] + "\n" + closing_tag
-    else:
-        end_index += len(closing_tag)
-        xfa_str = xfa_str[start_index:end_index]
-    return xfa_str
+        return xfa_data[start_index:] + b"\n" + closing_tag
+    return xfa_data[start_index:end_index + len(closing_tag)]
+
+def _find_template(xfa_xml):
+    # lxml's tag-filtered iteration (and so find() and XPath) looks ahead for
+    # the next match once the first is found, which walks the whole datasets
+    # packet. An unfiltered walk returns as soon as the template is reached.
+    for el in xfa_xml.iterdescendants():
+        if el.tag == _TEMPLATE_TAG:
+            return el
+    return None
 
 def extract_all_js(xfa_xml):
     """
@@ -114,15 +224,22 @@ def extract_all_js(xfa_xml):
     in the XFA XML (using the XFA namespace).
     """
     js_parts = []
-    for script_el in xfa_xml.findall(".//{http://www.xfa.org/schema/xfa-template/3.3/}script"):
+    for script_el in _XP_SCRIPTS(xfa_xml):
         if script_el.text:
             js_parts.append(script_el.text)
     return "\n".join(js_parts)
 
-def save_xfa_as_html(xfa_xml, output_html_path, xslt_path=None):
+@functools.lru_cache(maxsize=8)
+def _load_xslt(path, mtime):
+    # mtime is part of the cache key so an edited stylesheet is recompiled.
+    return etree.XSLT(etree.parse(path, _XML_PARSER))
+
+def save_xfa_as_html(xfa_xml, output_html_path, xslt_path=None, debug=False):
+    # The pretty-printed XML page is purely diagnostic; only build it on request.
+    if not debug and xslt_path is None:
+        return
     if xslt_path:
-        xslt_doc = etree.parse(xslt_path)
-        transform = etree.XSLT(xslt_doc)
+        transform = _load_xslt(xslt_path, os.path.getmtime(xslt_path))
         html_tree = transform(xfa_xml)
         html_str = etree.tostring(html_tree, pretty_print=True, method="html", encoding="utf-8").decode("utf-8")
     else:
@@ -142,152 +259,166 @@ def save_xfa_as_html(xfa_xml, output_html_path, xslt_path=None):
         f.write(html_str)
     print(f"Debug HTML saved as '{output_html_path}'.")
 
-def build_ui_interpreter_stacked(xfa_xml):
+@functools.lru_cache(maxsize=256)
+def _local(tag):
     """
-    Advanced UI interpreter that:
-      - Ignores absolute x,y coordinates so that elements are stacked vertically.
-      - Preserves all elements and cascade attributes.
-      - Uses block-level elements so that elements appear one under another.
-      - Interprets various XFA UI elements into HTML:
-          • subform -> div with header
-          • field -> label + input (or button if indicated)
-          • button -> HTML button
-          • text -> static text
-          • textEdit -> input type='text'
-          • numericEdit -> input type='number'
-          • choiceList -> select with options from child "item" nodes
-          • draw -> div with class "draw"
-          • exclGroup -> group of radio buttons (child items)
-          • checkButton -> input type='checkbox'
-      - Injects all JavaScript extracted from the XFA XML.
-      - Injects an advanced XFA JavaScript runtime.
-      - Attaches event handlers to buttons that load the runtime and translate Acrobat JS.
+    Returns the lower-cased local name of a Clark-notation tag ("{ns}name").
+    Cached, since a form only uses a handful of distinct tags.
     """
-    ui_title = "Stacked Interpreted XFA Form"
-    cascade_required = False
+    i = tag.rfind("}")
+    return tag[i + 1:].lower() if i >= 0 else tag.lower()
+
+# Interned XFA attribute names for the per-element lookups below.
+_A_NAME = sys.intern("name")
+_A_VALUE = sys.intern("value")
+_A_LABEL = sys.intern("label")
+_A_TYPE = sys.intern("type")
+_A_UITYPE = sys.intern("uiType")
+_A_CASCADE = sys.intern("cascade")
+
+def _tb_element(tb, tag, attrs, text=None):
+    # Emit a complete element with optional text content.
+    tb.start(tag, attrs)
+    if text:
+        tb.data(text)
+    tb.end(tag)
+
+# Tag handlers for build_ui_interpreter_stacked. Each one emits its element
+# into the TreeBuilder and returns the tag to end once its children have been
+# rendered, "" to render the children with nothing to end, or None for a leaf.
+def _h_subform(el, tb, cascade_attrs):
+    sf_name = el.get(_A_NAME, "Subform")
+    tb.start("div", {"class": "subform"})
+    _tb_element(tb, "h2", {}, sf_name)
+    return "div"
+
+def _h_field(el, tb, cascade_attrs):
+    a = el.attrib
+    field_name = a.get(_A_NAME, "UnnamedField")
+    field_label = a.get(_A_LABEL, field_name)
+    field_value = a.get(_A_VALUE, "")
+    field_type = a.get(_A_TYPE, "text")
+    ui_type = a.get(_A_UITYPE, "").lower()
+    tb.start("div", {"class": "field"})
+    # Render as button if uiType indicates button OR name starts/ends with 'btn'
+    fn = field_name.lower()
+    if "button" in ui_type or fn.startswith(("btn", "button")) or fn.endswith("btn"):
+        # Optionally, you can embed Acrobat JS via a data attribute if available:
+        # e.g. data-acrobat-js="app.alert('Hello from Acrobat JS');"
+        _tb_element(tb, "button", {"type": "button", "id": field_name, "name": field_name, **cascade_attrs},
+                    field_label)
+    else:
+        _tb_element(tb, "label", {"for": field_name}, field_label)
+        _tb_element(tb, "input", {"type": field_type, "id": field_name, "name": field_name,
+                                  "value": field_value, **cascade_attrs})
+    tb.end("div")
+    return None
+
+def _h_button(el, tb, cascade_attrs):
+    btn_text = el.text or "Button"
+    btn_id = el.get(_A_NAME, "button")
+    tb.start("div", {"class": "button"})
+    _tb_element(tb, "button", {"type": "button", "id": btn_id, "name": btn_id}, btn_text)
+    tb.end("div")
+    return None
+
+def _h_text(el, tb, cascade_attrs):
+    txt = el.text or ""
+    _tb_element(tb, "div", {"class": "static-text"}, txt)
+    return None
+
+def _h_textedit(el, tb, cascade_attrs):
+    # Render textEdit as a text input
+    a = el.attrib
+    field_name = a.get(_A_NAME, "TextEdit")
+    field_value = a.get(_A_VALUE, "")
+    tb.start("div", {"class": "textedit"})
+    _tb_element(tb, "input", {"type": "text", "id": field_name, "name": field_name,
+                              "value": field_value, **cascade_attrs})
+    tb.end("div")
+    return None
+
+def _h_numericedit(el, tb, cascade_attrs):
+    # Render numericEdit as a number input
+    a = el.attrib
+    field_name = a.get(_A_NAME, "NumericEdit")
+    field_value = a.get(_A_VALUE, "")
+    tb.start("div", {"class": "numericedit"})
+    _tb_element(tb, "input", {"type": "number", "id": field_name, "name": field_name,
+                              "value": field_value, **cascade_attrs})
+    tb.end("div")
+    return None
+
+def _h_choicelist(el, tb, cascade_attrs):
+    # Render choiceList as a select element
+    field_name = el.get(_A_NAME, "ChoiceList")
+    tb.start("div", {"class": "choicelist"})
+    _tb_element(tb, "label", {"for": field_name}, field_name)
+    tb.start("select", {"id": field_name, "name": field_name, **cascade_attrs})
+    # Look for direct child "item" elements for options
+    for item in _XP_ITEMS(el):
+        option_value = item.get(_A_VALUE, item.text or "")
+        option_text = item.text or option_value
+        _tb_element(tb, "option", {"value": option_value}, option_text)
+    tb.end("select")
+    tb.end("div")
+    return None
+
+def _h_draw(el, tb, cascade_attrs):
+    # Render draw elements as a simple div container (could later be enhanced for graphics)
+    tb.start("div", {"class": "draw", "style": "border:1px solid #aaa; padding:5px;"})
+    # If the draw element has text content, include it.
+    if el.text and el.text.strip():
+        _tb_element(tb, "span", {}, el.text.strip())
+    # Process child elements, then close the container
+    return "div"
+
+def _h_exclgroup(el, tb, cascade_attrs):
+    # Render exclGroup as a set of radio buttons. Assume each direct child "exclChoice" represents an option.
+    group_name = el.get(_A_NAME, "ExclGroup")
+    tb.start("div", {"class": "exclgroup"})
+    for choice in _XP_EXCLCHOICE(el):
+        option_value = choice.get(_A_VALUE, choice.text or "")
+        option_label = choice.text or option_value
+        tb.start("label", {})
+        _tb_element(tb, "input", {"type": "radio", "name": group_name, "value": option_value, **cascade_attrs})
+        tb.data(f" {option_label}")
+        tb.end("label")
+    tb.end("div")
+    return None
+
+def _h_checkbutton(el, tb, cascade_attrs):
+    # Render checkButton as a checkbox
+    field_name = el.get(_A_NAME, "CheckButton")
+    tb.start("div", {"class": "checkbutton"})
+    tb.start("label", {})
+    _tb_element(tb, "input", {"type": "checkbox", "id": field_name, "name": field_name, **cascade_attrs})
+    tb.data(f" {field_name}")
+    tb.end("label")
+    tb.end("div")
+    return None
+
+def _h_default(el, tb, cascade_attrs):
+    # For any other tags, process their children.
+    return ""
+
+_TAG_HANDLERS = {
+    "subform": _h_subform,
+    "field": _h_field,
+    "button": _h_button,
+    "text": _h_text,
+    "textedit": _h_textedit,
+    "numericedit": _h_numericedit,
+    "choicelist": _h_choicelist,
+    "draw": _h_draw,
+    "exclgroup": _h_exclgroup,
+    "checkbutton": _h_checkbutton,
+}
 
-    def process_element(el):
-        if not isinstance(el, etree._Element):
-            return ""
-        try:
-            tag = etree.QName(el).localname.lower()
-        except Exception:
-            return ""
-        html_parts = []
-        cascade = el.get("cascade")
-        if cascade:
-            cascade_attr = f" data-cascade='{cascade}'"
-            nonlocal cascade_required
-            cascade_required = True
-        else:
-            cascade_attr = ""
-
-        # Handle known UI element types:
-        if tag == "subform":
-            sf_name = el.get("name", "Subform")
-            html_parts.append(f"<div class='subform'>")
-            html_parts.append(f"<h2>{sf_name}</h2>")
-            for child in el:
-                html_parts.append(process_element(child))
-            html_parts.append("</div>")
-        elif tag == "field":
-            field_name = el.get("name", "UnnamedField")
-            field_label = el.get("label", field_name)
-            field_value = el.get("value", "")
-            field_type = el.get("type", "text")
-            ui_type = el.get("uiType", "").lower()
-            # Render as button if uiType indicates button OR name starts/ends with 'btn'
-            if ("button" in ui_type or
-                field_name.lower().startswith("btn") or
-                field_name.lower().startswith("button") or
-                field_name.lower().endswith("btn")):
-                html_parts.append(f"<div class='field'>")
-                # Optionally, you can embed Acrobat JS via a data attribute if available:
-                # e.g. data-acrobat-js="app.alert('Hello from Acrobat JS');"
-                html_parts.append(f"<button type='button' id='{field_name}' name='{field_name}'{cascade_attr}>"
-                                  f"{field_label}</button>")
-                html_parts.append("</div>")
-            else:
-                html_parts.append(f"<div class='field'>")
-                html_parts.append(f"<label for='{field_name}'>{field_label}</label>")
-                html_parts.append(f"<input type='{field_type}' id='{field_name}' name='{field_name}' value='{field_value}'{cascade_attr} />")
-                html_parts.append("</div>")
-        elif tag == "button":
-            btn_text = el.text or "Button"
-            btn_id = el.get("name", "button")
-            html_parts.append(f"<div class='button'>")
-            html_parts.append(f"<button type='button' id='{btn_id}' name='{btn_id}'>{btn_text}</button>")
-            html_parts.append("</div>")
-        elif tag == "text":
-            txt = el.text or ""
-            html_parts.append(f"<div class='static-text'>{txt}</div>")
-        elif tag == "textedit":
-            # Render textEdit as a text input
-            field_name = el.get("name", "TextEdit")
-            field_value = el.get("value", "")
-            html_parts.append(f"<div class='textedit'>")
-            html_parts.append(f"<input type='text' id='{field_name}' name='{field_name}' value='{field_value}'{cascade_attr} />")
-            html_parts.append("</div>")
-        elif tag == "numericedit":
-            # Render numericEdit as a number input
-            field_name = el.get("name", "NumericEdit")
-            field_value = el.get("value", "")
-            html_parts.append(f"<div class='numericedit'>")
-            html_parts.append(f"<input type='number' id='{field_name}' name='{field_name}' value='{field_value}'{cascade_attr} />")
-            html_parts.append("</div>")
-        elif tag == "choicelist":
-            # Render choiceList as a select element
-            field_name = el.get("name", "ChoiceList")
-            html_parts.append(f"<div class='choicelist'>")
-            html_parts.append(f"<label for='{field_name}'>{field_name}</label>")
-            html_parts.append(f"<select id='{field_name}' name='{field_name}'{cascade_attr}>")
-            # Look for child "item" elements for options
-            for item in el.findall(".//item"):
-                option_value = item.get("value", item.text or "")
-                option_text = item.text or option_value
-                html_parts.append(f"<option value='{option_value}'>{option_text}</option>")
-            html_parts.append("</select>")
-            html_parts.append("</div>")
-        elif tag == "draw":
-            # Render draw elements as a simple div container (could later be enhanced for graphics)
-            html_parts.append(f"<div class='draw' style='border:1px solid #aaa; padding:5px;'>")
-            # If the draw element has text content, include it.
-            if el.text and el.text.strip():
-                html_parts.append(f"<span>{el.text.strip()}</span>")
-            # Process child elements
-            for child in el:
-                html_parts.append(process_element(child))
-            html_parts.append("</div>")
-        elif tag == "exclgroup":
-            # Render exclGroup as a set of radio buttons. Assume each child "exclChoice" represents an option.
-            group_name = el.get("name", "ExclGroup")
-            html_parts.append(f"<div class='exclgroup'>")
-            for choice in el.findall(".//exclchoice"):
-                option_value = choice.get("value", choice.text or "")
-                option_label = choice.text or option_value
-                html_parts.append(f"<label><input type='radio' name='{group_name}' value='{option_value}'{cascade_attr}/> {option_label}</label>")
-            html_parts.append("</div>")
-        elif tag == "checkbutton":
-            # Render checkButton as a checkbox
-            field_name = el.get("name", "CheckButton")
-            html_parts.append(f"<div class='checkbutton'>")
-            html_parts.append(f"<label><input type='checkbox' id='{field_name}' name='{field_name}'{cascade_attr}/> {field_name}</label>")
-            html_parts.append("</div>")
-        else:
-            # For any other tags, process their children.
-            for child in el:
-                html_parts.append(process_element(child))
-        return "\n".join(html_parts)
-
-    template = xfa_xml.find(".//{http://www.xfa.org/schema/xfa-template/3.3/}template")
-    if template is None:
-        template = xfa_xml
-    body_content = f"<div class='xfa-container'>\n{process_element(template)}\n</div>"
+# Static page parts for build_ui_interpreter_stacked, built once at import.
 
-    # If cascade attributes are present, include the cascade JS.
-    cascade_js = ""
-    if cascade_required:
-        cascade_js = r"""
+# Keeps inputs that share a cascade group in sync.
+_CASCADE_JS = r"""
 document.addEventListener('DOMContentLoaded', function(){
     var inputs = document.querySelectorAll("input[data-cascade], button[data-cascade]");
     inputs.forEach(function(input){
@@ -303,11 +434,9 @@ document.addEventListener('DOMContentLoaded', function(){
     });
 });
 """
-    # Extract all JS content from the XFA.
-    all_js = extract_all_js(xfa_xml)
 
-    # Basic adapter for schCar and our new translator function.
-    adapter = r"""
+# Basic adapter for schCar and our new translator function.
+_ADAPTER_JS = r"""
 if (typeof schCar === 'undefined') {
     var schCar = {
         schEnt: function(str) {
@@ -325,8 +454,8 @@ function translateAcrobatJS(acrobatJS) {
 }
 """
 
-    # Advanced XFA JavaScript Runtime Support.
-    xfa_runtime_js = r"""
+# Advanced XFA JavaScript Runtime Support.
+_XFA_RUNTIME_JS = r"""
 // Advanced XFA JavaScript Runtime Support
 if (typeof window.xfa === 'undefined') {
     window.xfa = {};
@@ -391,8 +520,8 @@ window.xfa.advanced = {
 };
 """
 
-    # New default event binding using event delegation.
-    default_bindings_js = r"""
+# New default event binding using event delegation.
+_DEFAULT_BINDINGS_JS = r"""
 document.addEventListener("DOMContentLoaded", function(){
     document.body.addEventListener("click", function(event){
         var target = event.target;
@@ -421,101 +550,226 @@ document.addEventListener("DOMContentLoaded", function(){
 });
 """
 
-    # Combine the adapter, advanced runtime, extracted XFA JS, and new default bindings.
-    ui_js = adapter + "\n" + xfa_runtime_js + "\n" + all_js + "\n" + default_bindings_js
-    full_js = cascade_js + "\n" + ui_js
-
-    html_doc = f"""<!DOCTYPE html>
-<html>
-<head>
-  <meta charset="UTF-8">
-  <title>{ui_title}</title>
-  <meta name="viewport" content="width=device-width, initial-scale=1.0">
-  <style>
-    body {{
+_CSS = """    body {
       margin: 0;
       padding: 20px;
       font-family: Arial, sans-serif;
       background: #eee;
-    }}
-    .xfa-container {{
+    }
+    .xfa-container {
       display: flex;
       flex-direction: column;
       gap: 20px;
       background: #fff;
       padding: 20px;
       box-shadow: 0 0 10px rgba(0,0,0,0.1);
-    }}
-    .subform, .field, .button, .static-text, .textedit, .numericedit, .choicelist, .draw, .exclgroup, .checkbutton {{
+    }
+    .subform, .field, .button, .static-text, .textedit, .numericedit, .choicelist, .draw, .exclgroup, .checkbutton {
       display: block;
       width: 100%;
       position: relative;
       margin-bottom: 10px;
-    }}
-    .subform {{
+    }
+    .subform {
       border: 1px dashed #888;
       padding: 10px;
-    }}
-    .field, .button, .static-text, .textedit, .numericedit, .choicelist, .draw, .exclgroup, .checkbutton {{
+    }
+    .field, .button, .static-text, .textedit, .numericedit, .choicelist, .draw, .exclgroup, .checkbutton {
       background: #fff;
       border: 1px solid #ccc;
       padding: 10px;
-    }}
-    label {{
+    }
+    label {
       display: block;
       margin-bottom: 5px;
       font-weight: bold;
-    }}
-    input[type="text"], input[type="number"] {{
+    }
+    input[type="text"], input[type="number"] {
       padding: 5px;
       width: 100%;
       box-sizing: border-box;
-    }}
-    button {{
+    }
+    button {
       padding: 10px 15px;
       cursor: pointer;
       font-size: 14px;
-    }}
-    select {{
+    }
+    select {
       padding: 5px;
       width: 100%;
       box-sizing: border-box;
-    }}
-    .static-text {{
+    }
+    .static-text {
       background: #f9f9f9;
       border: 1px solid #ddd;
-    }}
-  </style>
+    }
+"""
+
+_HTML_SHELL = string.Template("""<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="UTF-8">
+  <title>$title</title>
+  <meta name="viewport" content="width=device-width, initial-scale=1.0">
+  <style>
+$css  </style>
 </head>
 <body>
-{body_content}
+$body
 <script>
-{full_js}
+$js
 </script>
 </body>
 </html>
-"""
-    return html_doc
+""")
 
-if __name__ == "__main__":
-    pdf_input = 'test.pdf'                    # Replace with your PDF file path.
-    basic_html_output = 'output_debug.html'   # For debugging purposes.
-    stacked_ui_output = 'stacked_UI.html'       # Final stacked UI output.
+def build_ui_interpreter_stacked(xfa_xml):
+    """
+    Advanced UI interpreter that:
+      - Ignores absolute x,y coordinates so that elements are stacked vertically.
+      - Preserves all elements and cascade attributes.
+      - Uses block-level elements so that elements appear one under another.
+      - Interprets various XFA UI elements into HTML:
+          • subform -> div with header
+          • field -> label + input (or button if indicated)
+          • button -> HTML button
+          • text -> static text
+          • textEdit -> input type='text'
+          • numericEdit -> input type='number'
+          • choiceList -> select with options from child "item" nodes
+          • draw -> div with class "draw"
+          • exclGroup -> group of radio buttons (child items)
+          • checkButton -> input type='checkbox'
+      - Injects all JavaScript extracted from the XFA XML.
+      - Injects an advanced XFA JavaScript runtime.
+      - Attaches event handlers to buttons that load the runtime and translate Acrobat JS.
+    """
+    ui_title = "Stacked Interpreted XFA Form"
+    cascade_required = False
+
+    def process_element(root, tb):
+        # Walk the tree with an explicit stack instead of recursion. Entries are
+        # (element, "enter") to render an element and (tag, "exit") to end a
+        # container opened on the way down.
+        nonlocal cascade_required
+        stack = [(root, "enter")]
+        while stack:
+            el, action = stack.pop()
+            if action == "exit":
+                tb.end(el)
+                continue
+            # Comments and processing instructions have a non-string tag.
+            if not isinstance(el, etree._Element) or not isinstance(el.tag, str):
+                continue
+            tag = _local(el.tag)
+            cascade = el.get(_A_CASCADE)
+            if cascade:
+                cascade_attrs = {"data-cascade": cascade}
+                cascade_required = True
+            else:
+                cascade_attrs = {}
+
+            # Handle known UI element types:
+            handler = _TAG_HANDLERS.get(tag, _h_default)
+            close = handler(el, tb, cascade_attrs)
+            if close is None:
+                continue
+            if close:
+                stack.append((close, "exit"))
+            stack.extend((child, "enter") for child in reversed(el))
+
+    template = _find_template(xfa_xml)
+    if template is None:
+        template = xfa_xml
+    # Build the HTML tree directly and serialize it once; lxml escapes
+    # attribute values and text on the way out.
+    tb = etree.TreeBuilder()
+    tb.start("div", {"class": "xfa-container"})
+    process_element(template, tb)
+    tb.end("div")
+    body_content = etree.tostring(tb.close(), method="html", encoding="unicode", pretty_print=True)
+
+    # If cascade attributes are present, include the cascade JS.
+    cascade_js = _CASCADE_JS if cascade_required else ""
+
+    # Extract all JS content from the XFA.
+    all_js = extract_all_js(xfa_xml)
+
+    # Combine the adapter, advanced runtime, extracted XFA JS, and new default bindings.
+    ui_js = _ADAPTER_JS + "\n" + _XFA_RUNTIME_JS + "\n" + all_js + "\n" + _DEFAULT_BINDINGS_JS
+    full_js = cascade_js + "\n" + ui_js
 
-    xfa_content = extract_xfa_data(pdf_input)
-    if xfa_content:
-        completed_xml_str = complete_xml(xfa_content)
+    return _HTML_SHELL.substitute(title=ui_title, css=_CSS, body=body_content, js=full_js)
+
+def convert_one(pdf_input, basic_html_output, stacked_ui_output, debug=False):
+    """
+    Runs the full pipeline for one PDF: extract the XFA packets, parse them,
+    then write the stacked UI (and the debug page if `debug` is set).
+    Returns True if the outputs were written.
+    """
+    xfa_packets = extract_xfa_packets(pdf_input)
+    if not xfa_packets:
+        print("No XFA content extracted; nothing to output.")
+        return False
+    try:
+        xfa_xml = parse_xfa_packets(xfa_packets)
+    except etree.XMLSyntaxError:
+        # Malformed or partial packets: fall back to textual reassembly.
+        # Like the original text path, map undecodable bytes to U+FFFD so
+        # stray or mis-declared bytes cannot sink the rescue parse.
+        joined = _join_packets(xfa_packets).decode('utf-8', errors='replace').encode('utf-8')
+        completed_xml = complete_xml(joined)
         try:
-            xfa_xml = etree.fromstring(completed_xml_str.encode('utf-8'))
+            xfa_xml = etree.XML(completed_xml, parser=_XML_PARSER)
         except Exception as e:
             print("Error parsing XFA XML:", e)
-            snippet = completed_xml_str[:200]
+            snippet = completed_xml[:200].decode('utf-8', errors='replace')
             print("Extracted data snippet:", snippet)
-        else:
-            save_xfa_as_html(xfa_xml, basic_html_output)
-            ui_html = build_ui_interpreter_stacked(xfa_xml)
-            with open(stacked_ui_output, "w", encoding="utf-8") as f:
-                f.write(ui_html)
-            print(f"Stacked UI HTML saved as '{stacked_ui_output}'.")
+            return False
+    save_xfa_as_html(xfa_xml, basic_html_output, debug=debug)
+    ui_html = build_ui_interpreter_stacked(xfa_xml)
+    with open(stacked_ui_output, "w", encoding="utf-8") as f:
+        f.write(ui_html)
+    print(f"Stacked UI HTML saved as '{stacked_ui_output}'.")
+    return True
+
+def _convert_tuple(args, debug=False):
+    # One bad PDF must not abort the batch: report it and record a failure.
+    try:
+        return convert_one(*args, debug=debug)
+    except Exception as e:
+        print(f"Error converting '{args[0]}':", e)
+        return False
+
+def convert_many(jobs, workers=None, debug=False):
+    """
+    Converts many PDFs in parallel. `jobs` is an iterable of
+    (pdf_input, basic_html_output, stacked_ui_output) tuples; returns the
+    convert_one results in the same order, with False for a job that
+    raised. Uses processes rather than threads because parsing and
+    serialization are CPU-bound.
+    """
+    if workers is None:
+        workers = min(os.cpu_count() or 1, 4)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(functools.partial(_convert_tuple, debug=debug), jobs))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert XFA forms in PDF files to HTML.")
+    parser.add_argument("pdfs", nargs="*", default=["test.pdf"],
+                        help="PDF files to convert (default: test.pdf)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes for batches (default: min(CPU count, 4))")
+    parser.add_argument("--debug", action="store_true",
+                        help="also write the pretty-printed XFA debug page")
+    args = parser.parse_args()
+
+    if len(args.pdfs) == 1:
+        convert_one(args.pdfs[0], 'output_debug.html', 'stacked_UI.html', debug=args.debug)
     else:
-        print("No XFA content extracted; nothing to output.")
+        # Name each PDF's outputs after it so a batch does not overwrite itself.
+        jobs = []
+        for pdf_input in args.pdfs:
+            stem = os.path.splitext(pdf_input)[0]
+            jobs.append((pdf_input, f"{stem}_debug.html", f"{stem}_stacked_UI.html"))
+        convert_many(jobs, args.workers, debug=args.debug)